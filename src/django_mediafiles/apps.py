@@ -2,7 +2,7 @@ from pathlib import Path
 from django.apps import AppConfig
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
-from django.core.checks import Error, register
+from django.core.checks import Error, Warning, register
 
 
 class DjangoMediaFiles(AppConfig):
@@ -33,3 +33,23 @@ def check_dependencies(app_configs, **kwargs):
                 )
             )
     return errors
+
+
+@register
+def check_progress_cache(app_configs, **kwargs):
+    warnings = []
+    alias = getattr(settings, 'MEDIAFILES_PROGRESS_CACHE', 'default')
+    backend = getattr(settings, 'CACHES', {}).get(alias, {}).get(
+        'BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+    )
+
+    if backend.endswith(('LocMemCache', 'DummyCache')):
+        warnings.append(
+            Warning(
+                f"Progress cache '{alias}' is not shared between processes.",
+                hint="Set MEDIAFILES_PROGRESS_CACHE to a redis or memcached cache alias, "
+                     "otherwise File.processing_progress is empty outside the worker process",
+                id='django-mediafiles.W001',
+            )
+        )
+    return warnings
@@ -10,6 +10,8 @@ from django_basemodels.managers import PolymorphicBaseModelQuerySet
 from django_basemodels.models import BaseModel
 from polymorphic.managers import PolymorphicManager
 from polymorphic.models import PolymorphicModel
+from .processors.base import PROGRESS_CACHE_KEY, get_progress_cache
+from .processors.document import DocumentProcessor
 from .processors.file import FileProcessor
 from .processors.image import ImageProcessor
 from .processors.video import VideoProcessor
@@ -87,6 +89,13 @@ class File(BaseModel, PolymorphicModel):
     def original_file_name(self):
         return self.__original_file_name
 
+    @property
+    def processing_progress(self) -> dict | None:
+        """Последний опубликованный процессором прогресс обработки (см. MEDIAFILES_PROGRESS_CACHE)"""
+        if not self.pk:
+            return None
+        return get_progress_cache().get(PROGRESS_CACHE_KEY.format(pk=self.pk))
+
 
 class ImageFile(File):
     allowed_types = ["image/*"]
@@ -95,6 +104,11 @@ class ImageFile(File):
     width = models.PositiveIntegerField(null=True, editable=False, verbose_name=_("Ширина"))
     height = models.PositiveIntegerField(null=True, editable=False, verbose_name=_("Высота"))
     thumbnail = models.ImageField(null=True, blank=True, editable=False, verbose_name=_("Миниатюра"))
+    placeholder = models.TextField(null=True, blank=True, editable=False, verbose_name=_("Заглушка"))
+    dominant_color = models.CharField(
+        null=True, blank=True, max_length=7, editable=False,
+        verbose_name=_("Основной цвет")
+    )
 
     compression_quality = models.PositiveIntegerField(
         default=85,
@@ -104,6 +118,22 @@ class ImageFile(File):
         default=[300, 300],
         verbose_name=_("Размер миниатюры")
     )
+    target_ssim = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(0), MaxValueValidator(1)],
+        verbose_name=_("Целевой SSIM")
+    )
+    thumbnail_max_bytes = models.PositiveIntegerField(
+        null=True, blank=True,
+        validators=[MinValueValidator(1)],
+        verbose_name=_("Максимальный размер миниатюры")
+    )
+    encoded_quality = models.PositiveIntegerField(null=True, editable=False, verbose_name=_("Итоговое качество"))
+    encoded_bytes = models.PositiveIntegerField(null=True, editable=False, verbose_name=_("Итоговый размер"))
+    thumbnail_quality = models.PositiveIntegerField(
+        null=True, editable=False,
+        verbose_name=_("Качество миниатюры")
+    )
 
     class Meta:
         verbose_name = _('Изображение')
@@ -121,6 +151,8 @@ class ImageFile(File):
             "max_size": self.__max_size,
             "quality": self.compression_quality,
             "thumbnail_size": self.thumbnail_size,
+            "target_ssim": self.target_ssim,
+            "thumbnail_max_bytes": self.thumbnail_max_bytes,
         }
 
     @property
@@ -149,6 +181,16 @@ class VideoFile(File):
 
 class DocumentFile(File):
     allowed_types = ["application/pdf", "text/plain"]
+    processor_class = DocumentProcessor
+
+    page_count = models.PositiveIntegerField(null=True, editable=False, verbose_name=_("Количество страниц"))
+    width = models.PositiveIntegerField(null=True, editable=False, verbose_name=_("Ширина"))
+    height = models.PositiveIntegerField(null=True, editable=False, verbose_name=_("Высота"))
+    preview = models.ImageField(null=True, blank=True, editable=False, verbose_name=_("Превью"))
+
+    encoding = models.CharField(null=True, blank=True, max_length=50, editable=False, verbose_name=_("Кодировка"))
+    line_count = models.PositiveIntegerField(null=True, editable=False, verbose_name=_("Количество строк"))
+    snippet = models.TextField(null=True, blank=True, editable=False, verbose_name=_("Фрагмент"))
 
     class Meta:
         verbose_name = _('Документ')
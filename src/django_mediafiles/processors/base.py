@@ -2,19 +2,46 @@ import abc
 import logging
 import os
 import tempfile
+import time
 from io import BytesIO
 from typing import Any
+from django.conf import settings
+from django.core.cache import caches
 from django.core.files import File as DjangoFile
 from django.core.files.storage import default_storage
 
+PROGRESS_CACHE_KEY = 'django-mediafiles:progress:{pk}'
+
+
+def get_progress_cache():
+    """
+    Кеш для прогресса обработки (настройка MEDIAFILES_PROGRESS_CACHE, по умолчанию 'default').
+    Прогресс пишет воркер Celery, а читает веб-процесс, поэтому кеш должен быть общим
+    для процессов (redis, memcached); LocMemCache виден только внутри своего процесса.
+    """
+    return caches[getattr(settings, 'MEDIAFILES_PROGRESS_CACHE', 'default')]
+
 
 class BaseProcessor(abc.ABC):
+    # Минимальный интервал между обновлениями прогресса (в секундах)
+    progress_interval = 1.0
+    # Время жизни записи о прогрессе в кеше (в секундах)
+    progress_cache_timeout = 60 * 60
+    # Размер блока при потоковом копировании файла из хранилища (в байтах)
+    chunk_size = 1024 * 1024
+
     def __init__(self, media_file, **kwargs):
         self._logger = logging.getLogger(__file__)
         self._media_file = media_file
         self._file_content = None
+        self._local_path = None
         self._changes = {}
         self._temp_files = []
+        # Файлы хранилища, замененные при обработке; удаляются после применения изменений
+        self._replaced_files = []
+        self._progress_reported_at = None
+        # Этапы обработки с отчетом о прогрессе, в порядке выполнения
+        self._progress_stages = []
 
     def _load_file_content(self):
         """Загрузка файла в память один раз"""
@@ -28,6 +55,24 @@ class BaseProcessor(abc.ABC):
                 raise
         return self._file_content
 
+    def _get_local_path(self):
+        """Получение пути к файлу на диске без загрузки его в память"""
+        if self._local_path is None:
+            name = self._media_file.file.name
+            try:
+                self._local_path = default_storage.path(name)
+            except NotImplementedError:
+                # Удаленное хранилище: копируем файл во временный блоками фиксированного размера
+                suffix = os.path.splitext(name)[1]
+                with default_storage.open(name, 'rb') as f, \
+                        tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tf:
+                    self._temp_files.append(tf.name)
+                    for chunk in f.chunks(self.chunk_size):
+                        tf.write(chunk)
+                    self._local_path = tf.name
+                self._logger.debug(f"File content streamed to {self._local_path}")
+        return self._local_path
+
     def _reset_buffer(self):
         """Сброс позиции буфера в начало"""
         if self._file_content:
@@ -55,9 +100,20 @@ class BaseProcessor(abc.ABC):
         self._changes[field_name] = getattr(self._media_file, field_name).name
         self._logger.debug(f"Saved to {field_name}: {filename}")
 
-    def _create_temp_file(self, content=None):
+    def _save_file_to_field(self, field_name, path, filename):
+        """Сохранение файла с диска в поле модели без чтения в память"""
+        with open(path, 'rb') as f:
+            getattr(self._media_file, field_name).save(
+                filename,
+                DjangoFile(f),
+                save=False
+            )
+        self._changes[field_name] = getattr(self._media_file, field_name).name
+        self._logger.debug(f"Saved to {field_name}: {filename}")
+
+    def _create_temp_file(self, content=None, suffix=None):
         """Создание временного файла с контекстным менеджером"""
-        with tempfile.NamedTemporaryFile(delete=False) as tf:
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tf:
             self._temp_files.append(tf.name)
             if content:
                 tf.write(content)
@@ -73,6 +129,57 @@ class BaseProcessor(abc.ABC):
                 self._logger.warning(f"Failed to delete {path}: {str(e)}")
         self._temp_files.clear()
 
+    def _delete_replaced_files(self):
+        """Удаление из хранилища файлов, замененных результатами обработки"""
+        for name in self._replaced_files:
+            try:
+                default_storage.delete(name)
+                self._logger.debug(f"Deleted replaced file: {name}")
+            except Exception as e:
+                self._logger.warning(f"Failed to delete {name}: {str(e)}")
+        self._replaced_files.clear()
+
+    def _report_progress(self, stage, percent, force=False, **extra):
+        """Публикация прогресса обработки в кеш и через сигнал с ограничением частоты"""
+        now = time.monotonic()
+        if (not force and self._progress_reported_at is not None
+                and now - self._progress_reported_at < self.progress_interval):
+            return
+
+        self._progress_reported_at = now
+        stage_percent = max(0.0, min(100.0, percent))
+
+        # Общий процент учитывает завершенные этапы, чтобы он не откатывался к 0 на следующем этапе
+        stages = self._progress_stages or [stage]
+        stage_index = stages.index(stage) if stage in stages else len(stages) - 1
+        progress = {
+            'stage': stage,
+            'stage_index': stage_index,
+            'stage_count': len(stages),
+            'stage_percent': round(stage_percent, 1),
+            'percent': round((stage_index * 100 + stage_percent) / len(stages), 1),
+            **extra,
+        }
+
+        try:
+            get_progress_cache().set(
+                PROGRESS_CACHE_KEY.format(pk=self._media_file.pk),
+                progress,
+                self.progress_cache_timeout
+            )
+        except Exception as e:
+            self._logger.warning(f"Failed to store progress: {str(e)}")
+
+        # Импорт внутри метода, чтобы избежать циклического импорта models -> processors -> signals
+        from ..signals import file_processing_progress
+        # send_robust: ошибка в обработчике сигнала не должна прерывать обработку файла
+        file_processing_progress.send_robust(
+            sender=self._media_file.__class__,
+            instance=self._media_file,
+            progress=progress
+        )
+        self._logger.debug(f"Progress: {progress}")
+
     def __enter__(self):
         return self
 
@@ -99,6 +206,7 @@ class BaseProcessor(abc.ABC):
         except Exception as e:
             self._logger.error(f"Failed to apply changes: {str(e)}")
             raise e
+        self._delete_replaced_files()
         self._cleanup_temp_files()
 
     @abc.abstractmethod
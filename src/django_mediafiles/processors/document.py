@@ -0,0 +1,167 @@
+import codecs
+import os
+import shutil
+import subprocess
+import tempfile
+from charset_normalizer import from_bytes
+from .file import FileProcessor
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+
+class DocumentProcessor(FileProcessor):
+    # Размер блока при чтении текстовых файлов (в байтах)
+    text_chunk_size = 64 * 1024
+    # Максимальное время рендера превью PDF (в секундах)
+    preview_timeout = 60
+
+    def __init__(self, media_file, preview_dpi=72, preview_max_size=1024, snippet_length=500):
+        self._preview_dpi = self._validate_positive('preview_dpi', preview_dpi)
+        self._preview_max_size = self._validate_positive('preview_max_size', preview_max_size)
+        self._snippet_length = self._validate_positive('snippet_length', snippet_length)
+
+        super().__init__(media_file)
+
+    def _validate_positive(self, name, value):
+        if value < 1:
+            raise ValueError(f'{name} must be greater than 0')
+
+        return value
+
+    def _extract_pdf_metadata(self, path):
+        """Чтение количества страниц и размеров первой страницы PDF"""
+        # Передаем открытый файл, а не путь: pypdf читает объекты по требованию через seek,
+        # тогда как при передаче пути загружает весь файл в память
+        with open(path, 'rb') as f:
+            reader = pypdf.PdfReader(f)
+            # Многие PDF защищены только паролем владельца и открываются с пустым паролем пользователя
+            if reader.is_encrypted and not self._decrypt_pdf(reader):
+                self._logger.warning("PDF is encrypted, skipping metadata")
+                return None
+
+            page_count = len(reader.pages)
+            if not page_count:
+                self._logger.warning("PDF has no pages, skipping metadata")
+                return None
+
+            page = reader.pages[0]
+            width, height = float(page.mediabox.width), float(page.mediabox.height)
+            if (page.rotation or 0) % 180:
+                width, height = height, width
+
+            return {
+                'page_count': page_count,
+                'width': round(width),
+                'height': round(height),
+            }
+
+    def _decrypt_pdf(self, reader):
+        """Попытка открыть зашифрованный PDF с пустым паролем пользователя"""
+        try:
+            return bool(reader.decrypt(''))
+        except Exception as e:
+            # Например, для AES без установленного cryptography
+            self._logger.warning(f"PDF decryption failed: {str(e)}")
+            return False
+
+    def _generate_pdf_preview(self, path, metadata):
+        """Рендер первой страницы PDF в изображение с ограниченным разрешением"""
+        if not shutil.which('pdftoppm'):
+            self._logger.warning("pdftoppm not found, skipping PDF preview")
+            return
+
+        # Ограничиваем DPI так, чтобы большая сторона превью не превышала preview_max_size
+        dpi = self._preview_dpi
+        max_side = max(metadata.get('width') or 0, metadata.get('height') or 0)
+        if max_side:
+            dpi = max(min(dpi, self._preview_max_size * 72 / max_side), 1)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            prefix = os.path.join(temp_dir, 'preview')
+            try:
+                subprocess.run(
+                    ['pdftoppm', '-f', '1', '-l', '1', '-r', f'{dpi:.2f}', '-png', '-singlefile', path, prefix],
+                    check=True,
+                    capture_output=True,
+                    timeout=self.preview_timeout
+                )
+            except subprocess.TimeoutExpired:
+                self._logger.warning(f"pdftoppm timed out after {self.preview_timeout}s, skipping PDF preview")
+                return
+            except subprocess.CalledProcessError as e:
+                self._logger.error(f"PDF preview rendering failed: {e.stderr.decode(errors='replace')}")
+                raise e
+
+            preview_name = f"preview_{os.path.splitext(self._media_file.file.name)[0]}.png"
+            self._save_file_to_field('preview', f'{prefix}.png', preview_name)
+        self._logger.info(f"Generated PDF preview at {dpi:.2f} DPI")
+
+    def _detect_encoding(self, sample):
+        """Определение кодировки текста по первому блоку"""
+        try:
+            # Инкрементальный декодер не падает на обрезанном в конце блока многобайтовом символе
+            codecs.getincrementaldecoder('utf-8')().decode(sample)
+            return 'utf-8-sig' if sample.startswith(codecs.BOM_UTF8) else 'utf-8'
+        except UnicodeDecodeError:
+            pass
+
+        match = from_bytes(sample).best()
+        return match.encoding if match else 'latin-1'
+
+    def _extract_text_metadata(self, path):
+        """Определение кодировки, количества строк и фрагмента текста блоками фиксированного размера"""
+        line_count = 0
+        last_char = ''
+        snippet = ''
+
+        with open(path, 'rb') as f:
+            chunk = f.read(self.text_chunk_size)
+            encoding = self._detect_encoding(chunk)
+            decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+            while True:
+                final = not chunk
+                text = decoder.decode(chunk, final=final)
+                if text:
+                    line_count += text.count('\n')
+                    last_char = text[-1]
+                    if len(snippet) < self._snippet_length:
+                        snippet += text[:self._snippet_length - len(snippet)]
+                if final:
+                    break
+                chunk = f.read(self.text_chunk_size)
+
+        # Последняя строка без завершающего перевода строки
+        if last_char and last_char != '\n':
+            line_count += 1
+
+        return {
+            'encoding': encoding,
+            'line_count': line_count,
+            'snippet': snippet,
+        }
+
+    def process(self):
+        self._logger.info(f'Processing document {self._media_file}...')
+
+        path = self._get_local_path()
+        mime_type = self._detect_mime_type()
+
+        try:
+            if mime_type == 'application/pdf':
+                if pypdf is None:
+                    self._logger.warning("pypdf is not installed, skipping PDF metadata")
+                    return
+
+                metadata = self._extract_pdf_metadata(path)
+                if metadata:
+                    self._changes.update(metadata)
+                    self._generate_pdf_preview(path, metadata)
+            elif mime_type.startswith('text/'):
+                self._changes.update(self._extract_text_metadata(path))
+        except Exception as e:
+            self._logger.error(f"Document processing error: {str(e)}")
+            raise e
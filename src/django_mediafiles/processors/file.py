@@ -3,13 +3,25 @@ import magic
 
 
 class FileProcessor(BaseProcessor):
+    def _read_header(self, size=2048):
+        """Чтение начала файла для определения типа"""
+        if self._file_content is None:
+            # Файл не загружен в память - читаем только заголовок с диска
+            with open(self._get_local_path(), 'rb') as f:
+                return f.read(size)
+
+        self._reset_buffer()
+        try:
+            return self._file_content.read(size)
+        finally:
+            self._reset_buffer()
+
     def _detect_mime_type(self):
-        """Определение MIME-типа с использованием загруженного контента"""
+        """Определение MIME-типа по заголовку файла"""
         self._logger.info(f'Start detecting mime-type...')
 
-        self._reset_buffer()
         try:
-            header = self._file_content.read(2048)
+            header = self._read_header()
             mime_type = magic.from_buffer(header, mime=True)
             self._changes['mime_type'] = mime_type
             self._logger.info(f"Detected MIME type: {mime_type}")
@@ -17,8 +29,6 @@ class FileProcessor(BaseProcessor):
         except Exception as e:
             self._logger.error(f"MIME detection failed: {str(e)}")
             raise e
-        finally:
-            self._reset_buffer()
 
     def process(self):
         self._logger.info(f'Processing file {self._media_file}...')
@@ -1,16 +1,50 @@
+import operator
+import os
+from base64 import b64encode
 from io import BytesIO
-from PIL import Image
+from PIL import Image, features
 from .file import FileProcessor
+from .pool import run_cpu_bound
 
 
 class ImageProcessor(FileProcessor):
-    def __init__(self, media_file, max_size=None, quality=85, thumbnail_size=(300, 300)):
+    # Количество цветов палитры при поиске основного цвета
+    dominant_palette_size = 8
+    # Минимальная непрозрачность пикселя, учитываемого при поиске основного цвета
+    dominant_min_alpha = 128
+    # Форматы с настраиваемым качеством сжатия
+    lossy_formats = ('JPEG', 'WEBP')
+    # Границы поиска качества; число итераций выводится из ширины диапазона (7 для 30-95)
+    quality_search_range = (30, 95)
+    # Качество миниатюры без бюджета (значение Pillow по умолчанию для JPEG),
+    # оно же верхняя граница поиска по бюджету
+    thumbnail_quality = 75
+    # Размер уменьшенной копии, на которой выполняются пробные сжатия
+    quality_probe_size = 256
+
+    def __init__(self, media_file, max_size=None, quality=85, thumbnail_size=(300, 300), placeholder_size=16,
+                 target_ssim=None, thumbnail_max_bytes=None):
         self._max_size = self._validate_max_size(max_size)
         self._compression_quality = self._validate_quality(quality)
         self._thumbnail_size = self._validate_thumbnail_size(thumbnail_size)
+        self._placeholder_size = self._validate_placeholder_size(placeholder_size)
+        self._target_ssim = self._validate_target_ssim(target_ssim)
+        self._thumbnail_max_bytes = self._validate_thumbnail_max_bytes(thumbnail_max_bytes)
+        self._rendered_files = {}
 
         super().__init__(media_file)
 
+    def _get_render_kwargs(self):
+        """Параметры для создания процессора в процессе пула"""
+        return {
+            'max_size': self._max_size,
+            'quality': self._compression_quality,
+            'thumbnail_size': self._thumbnail_size,
+            'placeholder_size': self._placeholder_size,
+            'target_ssim': self._target_ssim,
+            'thumbnail_max_bytes': self._thumbnail_max_bytes,
+        }
+
     def _validate_max_size(self, max_size):
         if max_size and max_size < 1:
             raise ValueError('max_size must be greater than 0')
@@ -34,6 +68,114 @@ class ImageProcessor(FileProcessor):
 
         return thumbnail_size
 
+    def _validate_placeholder_size(self, placeholder_size):
+        if placeholder_size < 1:
+            raise ValueError('placeholder_size must be greater than 0')
+
+        return placeholder_size
+
+    def _validate_target_ssim(self, target_ssim):
+        if target_ssim is not None and not (0 <= target_ssim <= 1):
+            raise ValueError('target_ssim must be between 0 and 1')
+
+        return target_ssim
+
+    def _validate_thumbnail_max_bytes(self, thumbnail_max_bytes):
+        if thumbnail_max_bytes is not None and thumbnail_max_bytes < 1:
+            raise ValueError('thumbnail_max_bytes must be greater than 0')
+
+        return thumbnail_max_bytes
+
+    @staticmethod
+    def _ssim(first: Image.Image, second: Image.Image, block=8):
+        """Средний SSIM яркости по неперекрывающимся блокам"""
+        c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+        width, height = first.size
+        block = max(min(block, width, height), 1)
+        first_data = first.convert('L').tobytes()
+        second_data = second.convert('L').tobytes()
+
+        total, count = 0.0, 0
+        for top in range(0, height - block + 1, block):
+            for left in range(0, width - block + 1, block):
+                xs, ys = [], []
+                for row in range(top, top + block):
+                    start = row * width + left
+                    xs.extend(first_data[start:start + block])
+                    ys.extend(second_data[start:start + block])
+
+                n = len(xs)
+                mean_x, mean_y = sum(xs) / n, sum(ys) / n
+                var_x = sum(map(operator.mul, xs, xs)) / n - mean_x ** 2
+                var_y = sum(map(operator.mul, ys, ys)) / n - mean_y ** 2
+                cov = sum(map(operator.mul, xs, ys)) / n - mean_x * mean_y
+
+                total += ((2 * mean_x * mean_y + c1) * (2 * cov + c2)) / (
+                    (mean_x ** 2 + mean_y ** 2 + c1) * (var_x + var_y + c2))
+                count += 1
+
+        return total / count if count else 1.0
+
+    def _search_quality(self, is_acceptable, prefer_lower=True, max_quality=None):
+        """
+        Бинарный поиск качества в quality_search_range (не выше max_quality).
+        prefer_lower=True - наименьшее качество, удовлетворяющее условию (условие растет с качеством),
+        prefer_lower=False - наибольшее качество, удовлетворяющее условию (условие падает с качеством).
+        """
+        low, high = self.quality_search_range
+        if max_quality is not None:
+            high = max(min(high, max_quality), low)
+        best = high if prefer_lower else low
+
+        # floor(log2(n)) + 1 проб достаточно, чтобы проверить любое из n значений
+        for _ in range((high - low + 1).bit_length()):
+            if low > high:
+                break
+
+            quality = (low + high) // 2
+            acceptable = is_acceptable(quality)
+            if acceptable:
+                best = quality
+
+            # Сужаем диапазон в сторону предпочтительного качества
+            if acceptable == prefer_lower:
+                high = quality - 1
+            else:
+                low = quality + 1
+
+        return best
+
+    def _encode(self, img: Image.Image, _format, quality):
+        """Пробное сжатие в память"""
+        output = BytesIO()
+        img.save(output, format=_format, quality=quality)
+        return output
+
+    def _search_quality_by_ssim(self, img: Image.Image):
+        """Подбор минимального качества, обеспечивающего target_ssim, на уменьшенной копии"""
+        # thumbnail только уменьшает: увеличенная копия маленького изображения исказила бы оценку
+        probe = img.copy()
+        probe.thumbnail((self.quality_probe_size, self.quality_probe_size))
+
+        def is_acceptable(quality):
+            with Image.open(self._encode(probe, img.format, quality)) as encoded:
+                return self._ssim(probe, encoded) >= self._target_ssim
+
+        quality = self._search_quality(is_acceptable)
+        self._logger.info(f"Selected quality {quality}% for SSIM {self._target_ssim}")
+        return quality
+
+    def _search_quality_by_size(self, img: Image.Image, max_bytes):
+        """Подбор максимального качества, при котором размер не превышает max_bytes"""
+        # Выше качества миниатюры без бюджета не поднимаемся: бюджет не должен увеличивать размер
+        quality = self._search_quality(
+            lambda q: self._encode(img, img.format, q).getbuffer().nbytes <= max_bytes,
+            prefer_lower=False,
+            max_quality=self.thumbnail_quality
+        )
+        self._logger.info(f"Selected quality {quality}% for {max_bytes} bytes")
+        return quality
+
     def _resize_image(self, img: Image.Image):
         """Изменение размера изображения"""
         original_max = max(img.size)
@@ -57,25 +199,78 @@ class ImageProcessor(FileProcessor):
 
     def _compress_image(self, img: Image.Image):
         """Сжатие изображения"""
-        output = BytesIO()
-        img.save(output, format=img.format, quality=self._compression_quality, optimize=True)
-        self._save_to_field('file', output.getvalue(), self._media_file.file.name)
-        self._logger.info(f"Compressed with quality {self._compression_quality}%")
+        quality = self._compression_quality
+        if self._target_ssim is not None and img.format in self.lossy_formats:
+            quality = self._search_quality_by_ssim(img)
+
+        output = self._create_temp_file()
+        img.save(output, format=img.format, quality=quality, optimize=True)
+        self._rendered_files['file'] = output
+        self._changes.update({
+            'encoded_quality': quality if img.format in self.lossy_formats else None,
+            'encoded_bytes': os.path.getsize(output),
+        })
+        self._logger.info(f"Compressed with quality {quality}%")
 
     def _generate_thumbnail(self, img):
         """Генерация миниатюры"""
-        thumb_output = BytesIO()
+        thumb_output = self._create_temp_file()
         img.thumbnail(self._thumbnail_size)
-        img.save(thumb_output, format=img.format)
-        self._save_to_field('thumbnail', thumb_output.getvalue(), f"thumb_{self._media_file.file.name}")
+
+        quality = None
+        if img.format in self.lossy_formats:
+            quality = self.thumbnail_quality
+            if self._thumbnail_max_bytes is not None:
+                quality = self._search_quality_by_size(img, self._thumbnail_max_bytes)
+
+        save_kwargs = {'quality': quality} if quality is not None else {}
+        img.save(thumb_output, format=img.format, **save_kwargs)
+        self._changes['thumbnail_quality'] = quality
+        self._rendered_files['thumbnail'] = thumb_output
         self._logger.info(f"Generated thumbnail {self._thumbnail_size}")
 
-    def process(self):
-        super().process()
+    def _get_dominant_color(self, img: Image.Image):
+        """Основной цвет - самый частый цвет квантованной палитры среди непрозрачных пикселей"""
+        quantized = img.convert('RGB').quantize(colors=self.dominant_palette_size)
+
+        if img.mode == 'RGBA':
+            # Прозрачные пиксели хранят произвольный (обычно черный) цвет, не учитываем их
+            counts = {}
+            for index, alpha in zip(quantized.getdata(), img.getchannel('A').getdata()):
+                if alpha >= self.dominant_min_alpha:
+                    counts[index] = counts.get(index, 0) + 1
+            if not counts:
+                return None
+            index = max(counts, key=counts.get)
+        else:
+            _, index = max(quantized.getcolors())
 
-        content = self._load_file_content()
+        red, green, blue = quantized.getpalette()[index * 3:index * 3 + 3]
+        return f"#{red:02x}{green:02x}{blue:02x}"
+
+    def _generate_placeholder(self, img: Image.Image):
+        """Генерация встраиваемой заглушки (LQIP) и основного цвета из уже уменьшенного изображения"""
+        placeholder = img.copy()
+        placeholder.thumbnail((self._placeholder_size, self._placeholder_size))
+        if placeholder.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in placeholder.getbands() or 'transparency' in placeholder.info
+            placeholder = placeholder.convert('RGBA' if has_alpha else 'RGB')
+
+        _format = 'WEBP' if features.check('webp') else 'PNG'
+        output = BytesIO()
+        placeholder.save(output, format=_format, quality=30)
+        data = b64encode(output.getvalue()).decode('ascii')
+
+        self._changes.update({
+            'placeholder': f"data:image/{_format.lower()};base64,{data}",
+            'dominant_color': self._get_dominant_color(placeholder),
+        })
+        self._logger.info(f"Generated placeholder {placeholder.size}")
+
+    def _render(self, path):
+        """CPU-bound часть обработки: результат возвращается в виде изменений и путей к временным файлам"""
         try:
-            with Image.open(content) as img:
+            with Image.open(path) as img:
 
                 self._logger.info(f'Start image file compressing...')
                 # Изменение размера
@@ -88,11 +283,43 @@ class ImageProcessor(FileProcessor):
                     'height': img.height,
                 })
 
-                # Сжатие и сохранение
+                # Сжатие
                 self._compress_image(img)
 
                 # Генерация миниатюры
                 self._generate_thumbnail(img)
+
+                # Генерация заглушки из миниатюры
+                self._generate_placeholder(img)
         except Exception as e:
             self._logger.error(f"Image processing error: {str(e)}")
+            self._cleanup_temp_files()
             raise e
+
+        return {
+            'changes': self._changes,
+            'files': self._rendered_files,
+        }
+
+    def process(self):
+        self._logger.info(f'Processing file {self._media_file}...')
+        self._detect_mime_type()
+
+        result = run_cpu_bound(_render_image, self._get_local_path(), self._get_render_kwargs())
+
+        # Временные файлы созданы исполнителем (возможно, в другом процессе), удаляем их вместе со своими
+        self._temp_files.extend(result['files'].values())
+        self._changes.update(result['changes'])
+
+        # Сохранение результатов
+        file_names = {
+            'file': self._media_file.file.name,
+            'thumbnail': f"thumb_{self._media_file.file.name}",
+        }
+        for field_name, path in result['files'].items():
+            self._save_file_to_field(field_name, path, file_names[field_name])
+
+
+def _render_image(path, render_kwargs):
+    """Точка входа для пула процессов: процессор создается без модели и работает только с файлами"""
+    return ImageProcessor(None, **render_kwargs)._render(path)
@@ -0,0 +1,70 @@
+"""
+Общий пул процессов для CPU-bound этапов обработки.
+
+Настройки:
+    MEDIAFILES_USE_PROCESS_POOL - включение пула (по умолчанию False, задачи выполняются в текущем потоке);
+    MEDIAFILES_PROCESS_POOL_SIZE - количество процессов (по умолчанию os.cpu_count());
+    MEDIAFILES_PROCESS_POOL_MAX_TASKS_PER_CHILD - перезапуск процесса после N задач (по умолчанию без ограничения).
+
+Задачи должны принимать пути к файлам и возвращать пути к временным файлам,
+а не передавать содержимое файлов через pickle.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Получение общего пула процессов с ленивым созданием"""
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        # После fork (например, prefork-воркер Celery) пул родителя непригоден
+        if _pool is None or _pool_pid != os.getpid():
+            max_workers = getattr(settings, 'MEDIAFILES_PROCESS_POOL_SIZE', None) or os.cpu_count()
+            max_tasks_per_child = getattr(settings, 'MEDIAFILES_PROCESS_POOL_MAX_TASKS_PER_CHILD', None)
+
+            # spawn безопасен для процессов с потоками (Celery threads/gevent, веб-сервер)
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                max_tasks_per_child=max_tasks_per_child
+            )
+            _pool_pid = os.getpid()
+            logger.info(f"Started process pool with {max_workers} workers")
+
+        return _pool
+
+
+def shutdown_process_pool(wait=True):
+    """Остановка общего пула процессов"""
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=wait, cancel_futures=not wait)
+        _pool = None
+        _pool_pid = None
+
+
+def run_cpu_bound(fn, *args, **kwargs):
+    """Выполнение CPU-bound задачи в общем пуле процессов, если он включен"""
+    if not getattr(settings, 'MEDIAFILES_USE_PROCESS_POOL', False):
+        return fn(*args, **kwargs)
+
+    try:
+        return get_process_pool().submit(fn, *args, **kwargs).result()
+    except BrokenProcessPool as e:
+        logger.warning(f"Process pool is broken, running in current process: {str(e)}")
+        shutdown_process_pool(wait=False)
+        return fn(*args, **kwargs)
@@ -1,14 +1,33 @@
 import datetime
-import tempfile
+import os
+import struct
+import threading
+import time
 from .file import FileProcessor
 import ffmpeg
 
 
 class VideoProcessor(FileProcessor):
-    def __init__(self, media_file, preview_size=(854, 480), crf=28, preset='fast'):
+    # Контейнер и кодеки, которые воспроизводятся браузерами без перекодирования
+    compatible_video_codecs = ('h264',)
+    compatible_audio_codecs = ('aac',)
+    compatible_pix_fmts = ('yuv420p', 'yuvj420p')
+
+    default_transcode_options = {
+        'c:v': 'libx264',
+        'crf': 23,
+        'preset': 'medium',
+        'pix_fmt': 'yuv420p',
+        'c:a': 'aac',
+    }
+
+    def __init__(self, media_file, preview_size=(854, 480), crf=28, preset='fast',
+                 normalize=True, transcode_options=None):
         self.preview_size = preview_size
         self.crf = crf  # 0-51, где меньше - лучше качество
         self.preset = preset
+        self.normalize = normalize
+        self.transcode_options = {**self.default_transcode_options, **(transcode_options or {})}
         self._validate_params()
 
         super().__init__(media_file)
@@ -26,94 +45,257 @@ class VideoProcessor(FileProcessor):
         if self.preset not in valid_presets:
             raise ValueError(f"Invalid preset. Valid values: {valid_presets}")
 
-    def _extract_metadata(self):
-        """Извлечение метаданных видео с помощью ffmpeg"""
+    def _extract_metadata(self, path):
+        """Извлечение метаданных видео с помощью ffprobe (единственный запуск на обработку)"""
         try:
-            # Создание временного файла для анализа
-            with tempfile.NamedTemporaryFile(suffix='.video') as temp_in:
-                temp_in.write(self._file_content.getvalue())
-                temp_in.flush()
+            probe = ffmpeg.probe(path)
+        except ffmpeg.Error as e:
+            self._logger.error(f"FFmpeg metadata extraction failed: {e.stderr.decode()}")
+            raise
+
+        video_stream = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+        audio_stream = next((s for s in probe['streams'] if s['codec_type'] == 'audio'), None)
+
+        return {
+            'duration': float(probe['format']['duration']),
+            'width': int(video_stream['width']),
+            'height': int(video_stream['height']),
+            'codec': video_stream.get('codec_name', 'unknown'),
+            'pix_fmt': video_stream.get('pix_fmt'),
+            'audio_codec': audio_stream.get('codec_name', 'unknown') if audio_stream else None,
+            'format_name': probe['format'].get('format_name', ''),
+        }
+
+    @staticmethod
+    def _is_faststart(path):
+        """Проверка, что атом moov расположен перед mdat (обход атомов верхнего уровня без чтения данных)"""
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return False
+
+                size, atom_type = struct.unpack('>I4s', header)
+                if atom_type == b'moov':
+                    return True
+                if atom_type == b'mdat':
+                    return False
+
+                header_size = 8
+                if size == 1:
+                    # 64-битный размер атома
+                    large_size = f.read(8)
+                    if len(large_size) < 8:
+                        return False
+                    size = struct.unpack('>Q', large_size)[0]
+                    header_size = 16
+                elif size == 0:
+                    # Атом до конца файла
+                    return False
+
+                # Размер меньше заголовка - файл поврежден (иначе seek назад зациклит обход)
+                if size < header_size:
+                    return False
+                f.seek(size - header_size, os.SEEK_CUR)
 
-                probe = ffmpeg.probe(temp_in.name)
-                video_stream = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+    def _has_compatible_codecs(self, metadata):
+        """Проверка, что потоки можно скопировать в mp4 без перекодирования"""
+        return (
+            metadata['codec'] in self.compatible_video_codecs
+            and metadata['pix_fmt'] in self.compatible_pix_fmts
+            and metadata['audio_codec'] in (None, *self.compatible_audio_codecs)
+        )
 
-                print("PROBE", probe)
+    def _normalize_source(self, path, metadata):
+        """
+        Приведение исходного видео к mp4 с faststart: remux без перекодирования, если возможно.
+        Возвращает путь к временному файлу или None, если нормализация не требуется.
+        """
+        is_mp4 = 'mp4' in metadata['format_name'].split(',') and self._changes.get('mime_type') == 'video/mp4'
 
-                return {
-                    'duration': float(probe['format']['duration']),
-                    'width': int(video_stream['width']),
-                    'height': int(video_stream['height']),
-                    'codec': video_stream.get('codec_name', 'unknown')
-                }
+        if self._has_compatible_codecs(metadata):
+            if is_mp4 and self._is_faststart(path):
+                self._logger.info("Video is already browser-compatible, skipping normalization")
+                return None
 
+            self._logger.info("Remuxing video with faststart...")
+            output_args = {'c': 'copy'}
+        else:
+            self._logger.info(f"Transcoding video from {metadata['codec']}/{metadata['audio_codec']}...")
+            output_args = dict(self.transcode_options)
+
+        # Субтитры отбрасываем: не все их форматы допустимы в mp4
+        output_path = self._create_temp_file(suffix='.mp4')
+        output = ffmpeg.output(
+            ffmpeg.input(path), output_path,
+            **output_args, sn=None, movflags='faststart', f='mp4'
+        )
+        try:
+            self._run_ffmpeg(output, 'normalize', metadata['duration'])
         except ffmpeg.Error as e:
-            self._logger.error(f"FFmpeg metadata extraction failed: {e.stderr.decode()}")
-            raise
+            self._logger.error(f"FFmpeg normalization failed: {e.stderr.decode()}")
+            raise e
+
+        return output_path
+
+    def _replace_source(self, normalized_path):
+        """Сохранение нормализованного файла вместо исходного"""
+        original_name = self._media_file.file.name
+        name = f"{os.path.splitext(original_name)[0]}.mp4"
+        self._save_file_to_field('file', normalized_path, name)
+        # Исходный файл удаляется после сохранения изменений в БД
+        self._replaced_files.append(original_name)
+        self._changes['mime_type'] = 'video/mp4'
+
+    @staticmethod
+    def _parse_progress_block(block, total_duration, started_at):
+        """Преобразование блока key=value из `-progress` ffmpeg в компактный словарь прогресса"""
+        out_time_us = block.get('out_time_us') or block.get('out_time_ms')
+        try:
+            out_time = max(int(out_time_us) / 1_000_000, 0.0)
+        except (TypeError, ValueError):
+            out_time = 0.0
+
+        try:
+            fps = float(block.get('fps', 0))
+        except ValueError:
+            fps = 0.0
 
-    def _generate_preview(self, metadata):
         try:
-            duration = metadata['duration']
-
-            with tempfile.NamedTemporaryFile(suffix='.preview.mp4') as temp_out:
-                # Создание временного входного файла
-                with tempfile.NamedTemporaryFile(suffix='.source.mp4') as temp_in:
-                    temp_in.write(self._file_content.getvalue())
-                    temp_in.flush()
-
-                    input_stream = ffmpeg.input(temp_in.name)
-                    segments = []
-
-                    # Логика выбора сегментов
-                    if duration <= 10:
-                        # Просто обрезаем до длительности
-                        video = input_stream.video.trim(end=duration)
-                        segments.append(video)
-                    else:
-                        # Генерация 5 сегментов
-                        interval = (duration - 2) / 4  # Интервал между началами отрезков
-                        for i in range(5):
-                            start = i * interval
-                            # Видео сегмент
-                            v = input_stream.video.trim(start=start, end=start + 2).setpts('PTS-STARTPTS')
-                            segments.append(v)
-
-                    # Склейка сегментов
-                    if len(segments) > 1:
-                        video = ffmpeg.concat(*segments, v=1, a=0)
-                    else:
-                        video = segments[0]
-
-                    # Масштабирование и кодирование
-                    video = video.filter('scale', *self.preview_size)
-                    output_args = {
-                        'c:v': 'libx264',
-                        'crf': self.crf,
-                        'preset': self.preset,
-                        'movflags': 'faststart'
-                    }
-
-                    output = ffmpeg.output(video, temp_out.name, **output_args)
-                    output.run(overwrite_output=True)
-
-                # Чтение результата
-                with open(temp_out.name, 'rb') as f:
-                    return f.read()
+            speed = float(block.get('speed', '').rstrip('x'))
+        except ValueError:
+            speed = 0.0
 
+        if block.get('progress') == 'end':
+            percent = 100.0
+        elif total_duration:
+            percent = min(out_time / total_duration * 100, 99.9)
+        else:
+            percent = 0.0
+
+        eta = None
+        if total_duration and out_time > 0 and percent < 100:
+            elapsed = time.monotonic() - started_at
+            eta = round(elapsed * (total_duration - out_time) / out_time, 1)
+
+        return {
+            'percent': percent,
+            'fps': round(fps, 2),
+            'speed': round(speed, 2),
+            'eta': eta,
+        }
+
+    def _run_ffmpeg(self, output, stage, total_duration):
+        """Запуск ffmpeg с разбором потока `-progress` и публикацией прогресса"""
+        process = (
+            output
+            .global_args('-progress', 'pipe:1', '-nostats')
+            .overwrite_output()
+            .run_async(pipe_stdout=True, pipe_stderr=True)
+        )
+
+        # stderr читается в отдельном потоке, чтобы ffmpeg не заблокировался на переполненном пайпе
+        stderr_chunks = []
+        stderr_reader = threading.Thread(
+            target=lambda: stderr_chunks.append(process.stderr.read()),
+            daemon=True
+        )
+        stderr_reader.start()
+
+        started_at = time.monotonic()
+        try:
+            self._report_progress(stage, 0.0, force=True)
+
+            block = {}
+            for raw_line in process.stdout:
+                key, _, value = raw_line.decode(errors='replace').strip().partition('=')
+                if not key:
+                    continue
+                block[key] = value.strip()
+
+                if key == 'progress':
+                    progress = self._parse_progress_block(block, total_duration, started_at)
+                    self._report_progress(stage, force=value == 'end', **progress)
+                    block = {}
+        except BaseException:
+            # Не оставляем ffmpeg работать после ошибки обработки
+            process.kill()
+            process.wait()
+            raise
+
+        process.wait()
+        stderr_reader.join()
+        stderr = b''.join(stderr_chunks)
+
+        if process.returncode != 0:
+            raise ffmpeg.Error('ffmpeg', None, stderr)
+
+    def _generate_preview(self, path, metadata):
+        duration = metadata['duration']
+        input_stream = ffmpeg.input(path)
+        segments = []
+
+        # Логика выбора сегментов
+        if duration <= 10:
+            # Просто обрезаем до длительности
+            video = input_stream.video.trim(end=duration)
+            segments.append(video)
+        else:
+            # Генерация 5 сегментов
+            interval = (duration - 2) / 4  # Интервал между началами отрезков
+            for i in range(5):
+                start = i * interval
+                # Видео сегмент
+                v = input_stream.video.trim(start=start, end=start + 2).setpts('PTS-STARTPTS')
+                segments.append(v)
+
+        # Склейка сегментов
+        if len(segments) > 1:
+            video = ffmpeg.concat(*segments, v=1, a=0)
+        else:
+            video = segments[0]
+
+        # Масштабирование и кодирование
+        video = video.filter('scale', *self.preview_size)
+        output_args = {
+            'c:v': 'libx264',
+            'crf': self.crf,
+            'preset': self.preset,
+            'movflags': 'faststart'
+        }
+
+        preview_path = self._create_temp_file(suffix='.preview.mp4')
+        output = ffmpeg.output(video, preview_path, **output_args)
+        try:
+            self._run_ffmpeg(output, 'preview', min(duration, 10))
         except ffmpeg.Error as e:
             self._logger.error(f"FFmpeg processing failed: {e.stderr.decode()}")
             raise e
 
+        return preview_path
+
     def process(self):
-        super().process()
+        self._logger.info(f'Processing file {self._media_file}...')
+
+        # Шаг 1: Определение типа без загрузки файла в память
+        self._detect_mime_type()
+        path = self._get_local_path()
 
-        # Шаг 1: Загрузка файла
-        self._load_file_content()
+        self._progress_stages = ['normalize', 'preview'] if self.normalize else ['preview']
 
         # Шаг 2: Извлечение метаданных
-        metadata = self._extract_metadata()
+        metadata = self._extract_metadata(path)
+
+        # Шаг 3: Нормализация исходного файла во временный файл
+        normalized_path = self._normalize_source(path, metadata) if self.normalize else None
+
+        # Шаг 4: Генерация превью
+        preview_path = self._generate_preview(path, metadata)
 
-        # Шаг 3: Генерация превью
-        preview_content = self._generate_preview(metadata)
+        # Файлы сохраняются в хранилище только после успешного выполнения всех шагов,
+        # чтобы при ошибке не оставлять в нем файлов без записи в БД
+        if normalized_path:
+            self._replace_source(normalized_path)
 
         # Обновление метаданных
         self._changes.update({
@@ -122,6 +304,5 @@ class VideoProcessor(FileProcessor):
             'height': metadata['height']
         })
         # Сохранение превью
-        if preview_content:
-            preview_name = f"preview_{self._media_file.file.name}"
-            self._save_to_field('preview', preview_content, preview_name)
+        preview_name = f"preview_{self._media_file.file.name}"
+        self._save_file_to_field('preview', preview_path, preview_name)
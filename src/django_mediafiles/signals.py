@@ -2,12 +2,19 @@ import logging
 from celery_hchecker import CeleryHealthChecker
 from django.db import transaction
 from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.dispatch import receiver, Signal
 from .tasks import process_file_task, _local_file_process
 from .models import File
 
 logger = logging.getLogger(__name__)
 
+# Отправляется процессором во время длительной обработки - в том процессе, где идет обработка
+# (обычно воркер Celery), а не в веб-процессе. Для чтения прогресса из веб-процесса
+# используйте File.processing_progress с общим кешем MEDIAFILES_PROGRESS_CACHE.
+# Аргументы: instance - обрабатываемый файл, progress - словарь с полями stage, stage_index, stage_count,
+# stage_percent, percent (общий по всем этапам), fps, speed, eta
+file_processing_progress = Signal()
+
 
 @receiver(post_save)
 def enqueue_processing(sender, instance: File, created, **kwargs):
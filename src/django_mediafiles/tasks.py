@@ -17,13 +17,18 @@ def process_file_task(file_pk: int, **processor_kwargs):
 
 
 def _local_file_process(instance, **processor_kwargs):
-    processor = instance.processor_class(media_file=instance, **processor_kwargs)
     try:
-        processor.process()
-        processor.apply_changes()
+        # Создание процессора внутри try: ошибка валидации параметров должна переводить файл в failed
+        processor = instance.processor_class(media_file=instance, **processor_kwargs)
+
+        # Контекстный менеджер удаляет временные файлы и при ошибке обработки
+        with processor:
+            processor.process()
+            processor.apply_changes()
 
         return "success"
-    except Exception:
+    except Exception as e:
+        logger.error(f"File processing failed: {str(e)}", exc_info=True)
         File.objects.filter(
             pk=instance.pk
         ).update(processing_status="failed")
@@ -1,12 +1,25 @@
+import os
+import random
 import shutil
+import struct
+import subprocess
+from io import BytesIO
 from pathlib import Path
 
 import pytest
+from django.core.cache import caches
 from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django_mediafiles.models import ImageFile, VideoFile, File
+from django_mediafiles.models import ImageFile, VideoFile, File, DocumentFile
+from django_mediafiles.processors.document import DocumentProcessor, pypdf
 from django_mediafiles.processors.image import ImageProcessor
+from django_mediafiles.processors import pool
+from django_mediafiles.processors.base import PROGRESS_CACHE_KEY
+from django_mediafiles.processors.pool import shutdown_process_pool
 from django_mediafiles.processors.video import VideoProcessor
+from django_mediafiles.signals import file_processing_progress
+from django_mediafiles.tasks import _local_file_process
 
 
 @pytest.mark.django_db
@@ -25,9 +38,135 @@ def test_image_processor(test_image, temp_media):
     assert img.width == 600
     assert img.height == 450
     assert img.thumbnail.name.startswith('thumb_')
+    assert img.placeholder.startswith('data:image/')
+    assert img.dominant_color == '#fe0000'
+    assert img.encoded_quality == 85
+    assert img.encoded_bytes == img.file.size
     assert img.processing_status == 'success'
 
 
+@pytest.mark.django_db
+def test_image_processor_quality_search(test_image, temp_media):
+    img = ImageFile.objects.create(
+        file=SimpleUploadedFile("test.jpg", test_image),
+        target_ssim=0.95,
+    )
+
+    processor = ImageProcessor(img, **img.get_processor_kwargs())
+    processor.process()
+    processor.apply_changes()
+
+    img.refresh_from_db()
+    # Однотонное изображение достигает целевого SSIM на минимальном качестве
+    assert img.encoded_quality == ImageProcessor.quality_search_range[0]
+    assert img.encoded_bytes == img.file.size
+
+
+@pytest.mark.django_db
+def test_image_processor_thumbnail_byte_budget(temp_media, mocker):
+    from PIL import Image
+    noise = random.Random(0).randbytes(800 * 600 * 3)
+    buffer = BytesIO()
+    Image.frombytes('RGB', (800, 600), noise).save(buffer, format='JPEG', quality=95)
+
+    img = ImageFile.objects.create(
+        file=SimpleUploadedFile("noise.jpg", buffer.getvalue()),
+        thumbnail_max_bytes=15_000,
+    )
+
+    search_spy = mocker.spy(ImageProcessor, '_search_quality_by_size')
+    processor = ImageProcessor(img, **img.get_processor_kwargs())
+    processor.process()
+    processor.apply_changes()
+
+    img.refresh_from_db()
+    # Шумная миниатюра не укладывается в бюджет на качестве по умолчанию - качество снижено
+    assert search_spy.spy_return == img.thumbnail_quality
+    assert img.thumbnail_quality < ImageProcessor.thumbnail_quality
+    assert img.thumbnail.size <= 15_000
+
+
+@pytest.mark.django_db
+def test_image_processor_generous_thumbnail_budget(test_image, temp_media):
+    img = ImageFile.objects.create(
+        file=SimpleUploadedFile("test.jpg", test_image),
+        thumbnail_max_bytes=10_000_000,
+    )
+
+    processor = ImageProcessor(img, **img.get_processor_kwargs())
+    processor.process()
+    processor.apply_changes()
+
+    img.refresh_from_db()
+    # Бюджет не поднимает качество выше миниатюры без бюджета
+    assert img.thumbnail_quality == ImageProcessor.thumbnail_quality
+
+
+def test_quality_search_covers_range():
+    processor = ImageProcessor(None)
+    low, high = ImageProcessor.quality_search_range
+
+    assert processor._search_quality(lambda q: True, prefer_lower=False) == high
+    assert processor._search_quality(lambda q: False, prefer_lower=False) == low
+    assert processor._search_quality(lambda q: True) == low
+    assert processor._search_quality(lambda q: q >= high) == high
+    assert processor._search_quality(lambda q: True, prefer_lower=False, max_quality=75) == 75
+
+
+def test_image_processor_accepts_model_ranges():
+    ImageProcessor(None, target_ssim=0, thumbnail_max_bytes=1)
+    ImageProcessor(None, target_ssim=1)
+
+    with pytest.raises(ValueError):
+        ImageProcessor(None, thumbnail_max_bytes=0)
+
+
+@pytest.mark.django_db
+def test_image_processor_process_pool(test_image, temp_media, settings, mocker):
+    settings.MEDIAFILES_USE_PROCESS_POOL = True
+    settings.MEDIAFILES_PROCESS_POOL_SIZE = 1
+    settings.MEDIAFILES_PROCESS_POOL_MAX_TASKS_PER_CHILD = 1
+
+    img = ImageFile.objects.create(
+        file=SimpleUploadedFile("test.jpg", test_image),
+        thumbnail_size=[300, 300]
+    )
+
+    pool_spy = mocker.spy(pool, 'get_process_pool')
+    # Дочерний процесс (spawn) импортирует модуль заново и не видит этот патч:
+    # если рендер выполнится в текущем процессе, тест упадет
+    mocker.patch.object(ImageProcessor, '_render', side_effect=AssertionError("rendered in parent process"))
+
+    try:
+        processor = ImageProcessor(img, max_size=600)
+        processor.process()
+        rendered_files = list(processor._temp_files)
+        assert rendered_files and all(Path(path).exists() for path in rendered_files)
+
+        processor.apply_changes()
+    finally:
+        shutdown_process_pool()
+
+    assert pool_spy.call_count == 1
+
+    img.refresh_from_db()
+    assert (img.width, img.height) == (600, 450)
+    assert img.thumbnail.name.startswith('thumb_')
+    assert not any(Path(path).exists() for path in rendered_files)
+
+
+def test_image_placeholder_ignores_transparent_pixels():
+    from PIL import Image
+    img = Image.new('RGBA', (300, 300), (0, 0, 0, 0))
+    img.paste((0, 0, 255, 255), (100, 100, 200, 200))
+
+    processor = ImageProcessor(None)
+    processor._generate_placeholder(img)
+
+    assert processor._changes['dominant_color'] == '#0000ff'
+    assert processor._changes['placeholder'].startswith('data:image/')
+
+
 def has_ffmpeg():
     return shutil.which("ffmpeg") is not None
 
@@ -44,6 +183,7 @@ def test_video_processor(temp_media):
             _video = VideoFile.objects.create(
                 file=DjangoFile(f, name=video_path.name)
             )
+        original_name = _video.file.name
 
         processor = VideoProcessor(_video)
         processor.process()
@@ -52,7 +192,184 @@ def test_video_processor(temp_media):
         _video.refresh_from_db()
         assert _video.duration.total_seconds() == total_seconds
         assert _video.preview.name.startswith('preview_')
+        assert _video.mime_type == 'video/mp4'
+        # Тестовые видео в yuv444p перекодируются, исходный файл удаляется
+        assert _video.file.name != original_name
+        assert not default_storage.exists(original_name)
+        assert VideoProcessor._is_faststart(_video.file.path)
+        assert _video.processing_progress['stage'] == 'preview'
+        assert _video.processing_progress['percent'] == 100
 
     test(test_video_short, 5.0)
     test(test_video_long, 20.0)
 
+
+@pytest.mark.skipif(not has_ffmpeg(), reason="Требуется установленный ffmpeg")
+@pytest.mark.django_db
+def test_video_processor_preview_failure_keeps_storage_clean(temp_media, mocker):
+    video_path = Path(__file__).parent / "test_video_short.mp4"
+    with video_path.open('rb') as f:
+        _video = VideoFile.objects.create(file=DjangoFile(f, name=video_path.name))
+    original_name = _video.file.name
+
+    mocker.patch.object(VideoProcessor, '_generate_preview', side_effect=RuntimeError("preview failed"))
+    assert _local_file_process(_video) == "failed"
+
+    _video.refresh_from_db()
+    assert _video.processing_status == 'failed'
+    assert _video.file.name == original_name
+    assert os.listdir(Path(temp_media) / 'videofile') == [Path(original_name).name]
+
+
+def test_video_progress_parsing():
+    block = {'fps': '24.00', 'out_time_us': '5000000', 'speed': '2.5x', 'progress': 'continue'}
+    progress = VideoProcessor._parse_progress_block(block, 10, 0)
+    assert progress['percent'] == 50
+    assert progress['fps'] == 24
+    assert progress['speed'] == 2.5
+
+    block = {'out_time_us': 'N/A', 'speed': 'N/A', 'progress': 'end'}
+    progress = VideoProcessor._parse_progress_block(block, 10, 0)
+    assert progress['percent'] == 100
+    assert progress['eta'] is None
+
+
+def test_progress_across_stages():
+    received = []
+
+    def collect(sender, progress, **kwargs):
+        received.append((progress['stage'], progress['stage_percent'], progress['percent']))
+
+    def broken(sender, **kwargs):
+        raise RuntimeError("receiver failure")
+
+    file_processing_progress.connect(broken, weak=False)
+    file_processing_progress.connect(collect, weak=False)
+    try:
+        processor = VideoProcessor(VideoFile(pk=1))
+        processor._progress_stages = ['normalize', 'preview']
+        processor._report_progress('normalize', 100, force=True)
+        processor._report_progress('preview', 0, force=True)
+        processor._report_progress('preview', 100, force=True)
+    finally:
+        file_processing_progress.disconnect(broken)
+        file_processing_progress.disconnect(collect)
+
+    assert received == [('normalize', 100, 50), ('preview', 0, 50), ('preview', 100, 100)]
+
+
+@pytest.mark.django_db
+def test_document_processor_text(temp_media):
+    content = 'первая строка\nвторая строка\nтретья'
+    doc = DocumentFile.objects.create(file=SimpleUploadedFile("test.txt", content.encode('utf-8')))
+
+    processor = DocumentProcessor(doc, snippet_length=10)
+    processor.process()
+    processor.apply_changes()
+
+    doc.refresh_from_db()
+    assert doc.mime_type == 'text/plain'
+    assert doc.encoding == 'utf-8'
+    assert doc.line_count == 3
+    assert doc.snippet == content[:10]
+
+
+@pytest.mark.skipif(pypdf is None, reason="Требуется установленный pypdf")
+@pytest.mark.django_db
+def test_document_processor_pdf(temp_media):
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(width=200, height=100)
+    writer.add_blank_page(width=200, height=100)
+    buffer = BytesIO()
+    writer.write(buffer)
+
+    doc = DocumentFile.objects.create(file=SimpleUploadedFile("test.pdf", buffer.getvalue()))
+
+    processor = DocumentProcessor(doc)
+    processor.process()
+    processor.apply_changes()
+
+    doc.refresh_from_db()
+    assert doc.mime_type == 'application/pdf'
+    assert doc.page_count == 2
+    assert (doc.width, doc.height) == (200, 100)
+
+
+def test_video_faststart_detection(tmp_path):
+    def atom(atom_type, payload=b''):
+        return struct.pack('>I4s', len(payload) + 8, atom_type) + payload
+
+    faststart = tmp_path / 'faststart.mp4'
+    faststart.write_bytes(atom(b'ftyp', b'isom') + atom(b'moov', b'\0' * 16) + atom(b'mdat', b'\0' * 64))
+    assert VideoProcessor._is_faststart(faststart)
+
+    assert not VideoProcessor._is_faststart(Path(__file__).parent / "test_video_short.mp4")
+
+
+@pytest.mark.parametrize('content', [
+    # 64-битный размер обрезан
+    struct.pack('>I4s', 1, b'free') + b'\0\0\0',
+    # 64-битный размер равен 0
+    struct.pack('>I4s', 1, b'free') + struct.pack('>Q', 0),
+    # 32-битный размер меньше заголовка
+    struct.pack('>I4s', 4, b'free') + b'\0' * 16,
+])
+def test_video_faststart_malformed_atoms(tmp_path, content):
+    path = tmp_path / 'malformed.mp4'
+    path.write_bytes(content)
+    assert not VideoProcessor._is_faststart(path)
+
+
+@pytest.mark.skipif(pypdf is None, reason="Требуется установленный pypdf")
+@pytest.mark.parametrize('user_password, page_count', [
+    # Только пароль владельца - открывается с пустым паролем пользователя
+    ('', 1),
+    ('secret', None),
+])
+@pytest.mark.django_db
+def test_document_processor_encrypted_pdf(temp_media, user_password, page_count):
+    writer = pypdf.PdfWriter()
+    writer.add_blank_page(width=200, height=100)
+    writer.encrypt(user_password=user_password, owner_password='owner')
+    buffer = BytesIO()
+    writer.write(buffer)
+
+    doc = DocumentFile.objects.create(file=SimpleUploadedFile("test.pdf", buffer.getvalue()))
+
+    processor = DocumentProcessor(doc)
+    processor.process()
+    processor.apply_changes()
+
+    doc.refresh_from_db()
+    assert doc.processing_status == 'success'
+    assert doc.page_count == page_count
+
+
+@pytest.mark.django_db
+def test_document_processor_preview_timeout(temp_media, mocker):
+    doc = DocumentFile.objects.create(file=SimpleUploadedFile("test.pdf", b'%PDF-1.4'))
+    mocker.patch('django_mediafiles.processors.document.shutil.which', return_value='/usr/bin/pdftoppm')
+    mocker.patch(
+        'django_mediafiles.processors.document.subprocess.run',
+        side_effect=subprocess.TimeoutExpired('pdftoppm', DocumentProcessor.preview_timeout)
+    )
+
+    processor = DocumentProcessor(doc)
+    processor._generate_pdf_preview(doc.file.path, {'width': 200, 'height': 100})
+
+    assert 'preview' not in processor._changes
+
+
+def test_progress_cache_is_configurable(settings):
+    settings.CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+        'progress': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'progress'},
+    }
+    settings.MEDIAFILES_PROGRESS_CACHE = 'progress'
+
+    video = VideoFile(pk=1)
+    VideoProcessor(video)._report_progress('preview', 100, force=True)
+
+    assert caches['progress'].get(PROGRESS_CACHE_KEY.format(pk=1))['percent'] == 100
+    assert caches['default'].get(PROGRESS_CACHE_KEY.format(pk=1)) is None
+    assert video.processing_progress['percent'] == 100